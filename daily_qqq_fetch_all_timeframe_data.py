@@ -1,41 +1,65 @@
 
 # daily_stock_fetch_all_timeframe_data.py
 # Fetches historical data for multiple stock tickers (e.g., QQQ, AAPL, MSFT) for multiple timeframes
-# (daily, 4h, weekly) using yfinance, updates existing CSV files in ticker-specific subdirectories,
+# (daily, 4h, weekly) using yfinance, updates existing CSV (or Parquet) files in ticker-specific subdirectories,
 # and handles deduplication and time zone consistency.
 # Rounds all numbers (Open, High, Low, Close, Volume) to 2 decimal places and allows toggling adjusted prices.
 
 import yfinance as yf
+from yfinance.exceptions import YFRateLimitError
+import numpy as np
 import pandas as pd
+import contextlib
+import io
+import json
+import multiprocessing as mp
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import pytz
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 
 # ----------------------------------
 # 1. Configuration and Setup
 # ----------------------------------
 tickers = ["QQQ", "AAPL", "XLK"]  # Add or remove tickers as needed
 output_folder = "./stock_data"
+index_filename = f"{output_folder}/_index.json"  # Sidecar cache of each file's last date, keyed by ticker/timeframe
 use_adjusted = True  # Toggle adjusted prices (True for yfinance default, False to match TradingView unadjusted)
+storage_format = "csv"  # "csv" or "parquet" (Snappy-compressed; existing CSV files are migrated on first run)
 ET = pytz.timezone('US/Eastern')
+# Reference times are taken once per run so every file is judged against the same clock
+NOW = datetime.now(ET)
+TODAY = NOW.replace(hour=0, minute=0, second=0, microsecond=0)
+MARKET_OPEN = TODAY.replace(hour=9, minute=30)
+max_workers = 8  # Concurrent Yahoo requests across all tickers and timeframes
+max_processes = 8  # Worker processes for parsing and merging (capped at the number of files to update)
+requests_per_second = 2  # Client-side cap on Yahoo requests, shared by all download threads
+max_retries = 4  # Retries per request when Yahoo rate-limits (HTTP 429)
+retry_backoff = 2  # Seconds before the first retry, doubled on each further attempt
 
 configs = {
     "daily_10y": {
         "interval": "1d",
         "max_days": 3650,
-        "filename_template": "{output_folder}/{ticker}/{ticker}_daily_10y.csv",
+        "filename_template": "{output_folder}/{ticker}/{ticker}_daily_10y.{ext}",
         "overlap_days": 2
     },
     "4h_729d": {
         "interval": "4h",
         "max_days": 729,
-        "filename_template": "{output_folder}/{ticker}/{ticker}_4h_729d.csv",
+        "filename_template": "{output_folder}/{ticker}/{ticker}_4h_729d.{ext}",
         "overlap_days": 1
     },
     "weekly_10y": {
         "interval": "1wk",
         "max_days": 3650,
-        "filename_template": "{output_folder}/{ticker}/{ticker}_weekly_10y.csv",
+        "filename_template": "{output_folder}/{ticker}/{ticker}_weekly_10y.{ext}",
         "overlap_days": 7
     }
 }
@@ -48,103 +72,272 @@ os.makedirs(output_folder, exist_ok=True)
 def format_date(dt, interval):
     return dt.strftime('%Y-%m-%d')
 
+def get_date_format(interval):
+    return '%Y-%m-%d %H:%M:%S' if interval == "4h" else '%Y-%m-%d'
+
+EXPECTED_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
+EXPECTED_COLUMN_SET = frozenset(EXPECTED_COLUMNS)
+
+CSV_COLUMN_TYPES = {
+    'Date': pa.timestamp('s'),
+    'Open': pa.float64(),
+    'High': pa.float64(),
+    'Low': pa.float64(),
+    'Close': pa.float64(),
+    'Volume': pa.float64()
+}
+
+# float32 only round-trips cents below about 2**17; frames with any price from 2**16 (~$65k) up,
+# e.g. BRK-A, stay float64 so edited ticker lists never lose precision.
+# Volumes use nullable unsigned ints so missing values stay missing instead of becoming 0.
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close']
+FLOAT32_PRICE_LIMIT = 2 ** 16
+UINT32_MAX = np.iinfo(np.uint32).max
+
+def downcast_history(df):
+    price_columns = [col for col in PRICE_COLUMNS if col in df.columns]
+    if price_columns and not (df[price_columns].max() >= FLOAT32_PRICE_LIMIT).any():
+        df = df.astype({col: 'float32' for col in price_columns})
+    if 'Volume' in df.columns:
+        volume = df['Volume'].round()
+        df['Volume'] = volume.astype('UInt64' if (volume > UINT32_MAX).any() else 'UInt32')
+    return df
+
+def read_csv_history(filename, interval):
+    # pyarrow's multithreaded reader parses Date straight to datetime64; it rejects the whole
+    # file on a malformed value, so fall back to pandas, which coerces bad dates to NaT.
+    try:
+        table = pacsv.read_csv(filename, convert_options=pacsv.ConvertOptions(column_types=CSV_COLUMN_TYPES))
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+    except pa.ArrowInvalid:
+        df = pd.read_csv(filename)
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce', format=get_date_format(interval))
+        return df
+
+def read_history(filename, interval, file_format=None):
+    # Dates are held in memory as naive ET datetimes; CSV files store them as formatted strings.
+    if (file_format or storage_format) == "parquet":
+        df = pd.read_parquet(filename, engine='pyarrow')
+    else:
+        df = read_csv_history(filename, interval)
+    return downcast_history(df.dropna(subset=['Date']))
+
+def write_history(df, filename, interval, append=False):
+    # append adds header-less rows to an existing CSV file; Parquet files are always rewritten
+    if storage_format == "parquet":
+        df.to_parquet(filename, engine='pyarrow', compression='snappy', index=False)
+    else:
+        df.to_csv(filename, mode='a' if append else 'w', header=not append, index=False,
+                  float_format='%.2f', date_format=get_date_format(interval))
+
+def migrate_csv_to_parquet(filename, interval):
+    csv_filename = os.path.splitext(filename)[0] + ".csv"
+    if storage_format != "parquet" or os.path.exists(filename) or not os.path.exists(csv_filename):
+        return
+    try:
+        write_history(read_history(csv_filename, interval, file_format="csv"), filename, interval)
+        print(f"🔁 Migrated {csv_filename} to {filename}.")
+    except Exception as e:
+        print(f"⚠️ Failed to migrate {csv_filename} to Parquet: {e}. Will re-download.")
+
 # ----------------------------------
 # 3. File Reading and Date Checking
 # ----------------------------------
+def load_index():
+    try:
+        with open(index_filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_index(index):
+    # Written to a temp file and swapped in, so a crash never leaves a half-written index
+    tmp_filename = f"{index_filename}.tmp"
+    with open(tmp_filename, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_filename, index_filename)
+
+def get_indexed_last_date(index, key, filename):
+    # A cached entry is trusted only while the file's mtime still matches the one recorded with it.
+    # Returns (last_date, verified); verified entries were recorded right after this script wrote
+    # and re-read the file, so its last row is known to be its maximum date.
+    entry = index.get(key)
+    if entry is None or entry.get("filename") != filename:
+        return None, False
+    try:
+        if os.stat(filename).st_mtime_ns != entry["mtime_ns"]:
+            return None, False
+        return ET.localize(datetime.fromisoformat(entry["last_date"])), entry.get("verified", False) is True
+    except (OSError, KeyError, ValueError):
+        return None, False
+
+def update_index(index, key, filename, last_date, verified=False):
+    index[key] = {
+        "filename": filename,
+        "last_date": last_date.replace(tzinfo=None).isoformat(),
+        "mtime_ns": os.stat(filename).st_mtime_ns,
+        "verified": verified
+    }
+
+def parse_fixed_date(raw, interval):
+    # Dates are written as fixed-width ASCII (YYYY-MM-DD, plus ' HH:MM:SS' for 4h); the length
+    # check pins the layout and fromisoformat raises ValueError on anything else.
+    if len(raw) != (19 if interval == "4h" else 10):
+        raise ValueError(f"Unexpected date format: {raw!r}")
+    return datetime.fromisoformat(raw.decode('ascii'))
+
+def read_last_date(filename, interval, tail_bytes=4096):
+    # Files are written sorted by Date, so the final line holds the last date.
+    # Raises ValueError/IndexError when the tail does not end in a parseable row.
+    if storage_format == "parquet":
+        dates = pd.read_parquet(filename, columns=['Date'], engine='pyarrow')['Date'].dropna()
+        if dates.empty:
+            raise ValueError("no dates")
+        return ET.localize(dates.max().to_pydatetime())
+    with open(filename, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - tail_bytes))
+        tail = f.read()
+    lines = [line for line in tail.splitlines() if line.strip()]
+    return ET.localize(parse_fixed_date(lines[-1].split(b',')[0].strip(b'"'), interval))
+
+def is_up_to_date(last_date, interval):
+    if interval == "4h":
+        return not (last_date.date() < TODAY.date() or (last_date.date() == TODAY.date() and NOW >= MARKET_OPEN))
+    return last_date.date() >= TODAY.date()
+
 def get_last_date_or_none(filename, interval):
+    # Returns (last_date, existing_df). existing_df is only set when the whole file had to be
+    # parsed anyway, so the caller can reuse it instead of reading the CSV a second time.
     if not os.path.exists(filename):
         print(f"⚠️ File {filename} does not exist.")
-        return None
+        return None, None
     try:
         if not os.access(filename, os.R_OK):
             print(f"⚠️ No read permission for {filename}. Will re-download.")
-            return None
-        df = pd.read_csv(filename, nrows=5)
-        expected_columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-        if not all(col in df.columns for col in expected_columns):
-            print(f"⚠️ Invalid columns in {filename}. Expected: {expected_columns}, Found: {df.columns.tolist()}\nFile content preview:\n{df.head()}\nWill re-download.")
-            return None
-        df = pd.read_csv(filename)
-        if interval == "4h":
-            df['Date'] = pd.to_datetime(df['Date'], errors='coerce', format='%Y-%m-%d %H:%M:%S').dt.tz_localize(ET)
+            return None, None
+        if storage_format == "parquet":
+            columns = pq.read_schema(filename).names
         else:
-            df['Date'] = pd.to_datetime(df['Date'], errors='coerce', format='%Y-%m-%d').dt.tz_localize(ET)
-        df.dropna(subset=['Date'], inplace=True)
-        if df.empty:
-            print(f"⚠️ No valid rows in {filename}. File content preview:\n{df.head()}\nWill re-download.")
-            return None
-        last_date = df['Date'].max()
+            columns = pd.read_csv(filename, nrows=1).columns.tolist()
+        if not EXPECTED_COLUMN_SET.issubset(columns):
+            print(f"⚠️ Invalid columns in {filename}. Expected: {EXPECTED_COLUMNS}, Found: {columns}\nWill re-download.")
+            return None, None
+        existing_df = None
+        try:
+            last_date = read_last_date(filename, interval)
+        except (ValueError, IndexError):
+            last_date = None
+        if last_date is None or last_date.year < 2000:
+            # An unparseable or stray final row must not condemn the file; judge it on its max date
+            df = read_history(filename, interval)
+            if df.empty:
+                print(f"⚠️ No valid rows in {filename}. Will re-download.")
+                return None, None
+            last_date = ET.localize(df['Date'].max().to_pydatetime())
+            existing_df = df
         if last_date.year < 2000:
-            print(f"⚠️ Suspicious last date in {filename}: {last_date}. File content preview:\n{df.head()}\nWill re-download.")
-            return None
-        now = datetime.now(ET)
-        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        market_open = today.replace(hour=9, minute=30, tzinfo=ET)
-        if interval == "4h":
-            if last_date.date() < today.date() or (last_date.date() == today.date() and now >= market_open):
-                return last_date
-            print(f"✅ {filename} is up-to-date (last date: {last_date}). Skipping fetch.")
-            return None
-        else:
-            if last_date.date() < today.date():
-                return last_date
-            print(f"✅ {filename} is up-to-date (last date: {last_date}). Skipping fetch.")
-            return None
+            print(f"⚠️ Suspicious last date in {filename}: {last_date}. Will re-download.")
+            return None, None
+        return last_date, existing_df
     except Exception as e:
         print(f"⚠️ Failed to read {filename}: {e}\nFile content preview:\n{df.head() if 'df' in locals() else 'No data read'}\nWill re-download.")
-        return None
+        return None, None
 
 # ----------------------------------
 # 4. Data Fetching
 # ----------------------------------
-def fetch_new_data(ticker, start_date, end_date, interval):
-    try:
-        data = yf.download(
-            ticker,
-            start=format_date(start_date, interval),
-            end=format_date(end_date, interval),
-            interval=interval,
-            auto_adjust=use_adjusted,
-            progress=False,
-            threads=True,
-            group_by='column'
-        )
-        if data.empty:
-            return data
-        if isinstance(data.columns, pd.MultiIndex):
-            data.columns = [col[0] if isinstance(col, tuple) else col for col in data.columns]
-        data = data[["Open", "High", "Low", "Close", "Volume"]]
-        data.index.name = "Date"
-        data.reset_index(inplace=True)
-        # Round to 2 decimals
-        data[['Open', 'High', 'Low', 'Close']] = data[['Open', 'High', 'Low', 'Close']].round(2)
-        data['Volume'] = data['Volume'].round(2)
-        if interval == "4h":
-            data['Date'] = pd.to_datetime(data['Date']).dt.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            data['Date'] = pd.to_datetime(data['Date']).dt.strftime('%Y-%m-%d')
+class RateLimiter:
+    # Spaces request start times evenly across threads so bursts never reach Yahoo's per-IP limit.
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+yahoo_limiter = RateLimiter(requests_per_second)
+
+def normalize_ticker_data(data, interval):
+    if data.empty:
         return data
-    except Exception as e:
-        print(f"❌ Error downloading {ticker} ({interval}): {e}")
-        return pd.DataFrame()
+    data = data.dropna(how='all')
+    if data.empty:
+        return data
+    data = data[["Open", "High", "Low", "Close", "Volume"]].copy()
+    data.index.name = "Date"
+    data.reset_index(inplace=True)
+    # Round to 2 decimals
+    data[['Open', 'High', 'Low', 'Close']] = data[['Open', 'High', 'Low', 'Close']].round(2)
+    data = downcast_history(data)
+    if interval == "4h":
+        data['Date'] = pd.to_datetime(data['Date']).dt.strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        data['Date'] = pd.to_datetime(data['Date']).dt.strftime('%Y-%m-%d')
+    return data
+
+def fetch_new_data(ticker, start_date, end_date, interval):
+    # Runs inside the download pool; Ticker.history keeps no module-level state, unlike yf.download.
+    # All Ticker objects share yfinance's session, so the cookie/crumb is fetched once per run.
+    # Concurrency is controlled only by the outer download pool and yahoo_limiter; yfinance
+    # starts no threads of its own here.
+    for attempt in range(max_retries + 1):
+        yahoo_limiter.wait()
+        try:
+            data = yf.Ticker(ticker).history(
+                start=format_date(start_date, interval),
+                end=format_date(end_date, interval),
+                interval=interval,
+                auto_adjust=use_adjusted,
+                prepost=False,
+                actions=False
+            )
+            return normalize_ticker_data(data, interval)
+        except YFRateLimitError:
+            if attempt == max_retries:
+                print(f"❌ Rate limited downloading {ticker} ({interval}) after {max_retries} retries.")
+                return pd.DataFrame()
+            delay = retry_backoff * 2 ** attempt + random.uniform(0, 1)
+            print(f"⏳ Rate limited on {ticker} ({interval}). Retrying in {delay:.1f}s...")
+            time.sleep(delay)
+        except Exception as e:
+            print(f"❌ Error downloading {ticker} ({interval}): {e}")
+            return pd.DataFrame()
 
 # ----------------------------------
 # 5. Data Merging and Deduplication
 # ----------------------------------
 def merge_and_deduplicate(existing_df, new_data, interval):
     if existing_df is None:
-        return new_data
+        # Nothing to merge with, but the new rows still have to come out sorted and unique
+        existing_df = new_data.iloc[:0]
     try:
-        expected_columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-        if not all(col in existing_df.columns for col in expected_columns):
-            print(f"⚠️ Corrupt file — invalid columns. Expected: {expected_columns}, Found: {existing_df.columns.tolist()}\nFile content preview:\n{existing_df.head()}\nOverwriting with fresh data.")
+        if not EXPECTED_COLUMN_SET.issubset(existing_df.columns):
+            print(f"⚠️ Corrupt file — invalid columns. Expected: {EXPECTED_COLUMNS}, Found: {existing_df.columns.tolist()}\nFile content preview:\n{existing_df.head()}\nOverwriting with fresh data.")
             return new_data
-        existing_df['Date'] = existing_df['Date'].astype(str)
-        new_data['Date'] = new_data['Date'].astype(str)
         print(f"🔍 Before concat: existing rows={len(existing_df)}, new rows={len(new_data)}")
-        combined = pd.concat([existing_df, new_data])
-        combined = combined.drop_duplicates(subset=['Date'], keep='last')
-        combined.sort_values(by="Date", inplace=True)
+        existing_dates = existing_df['Date']
+        new_dates = new_data['Date']
+        if (existing_dates.is_monotonic_increasing and new_dates.is_monotonic_increasing and new_dates.is_unique
+                and (existing_dates.empty or new_dates.iloc[0] > existing_dates.iloc[-1])):
+            # Both sides sorted and every new row post-dates the file: a plain append suffices
+            combined = pd.concat([existing_df, new_data], ignore_index=True)
+        else:
+            # Existing and new rows are two sorted runs; a stable sort (timsort) detects the runs and
+            # merges them in one linear pass. Ties keep the new row, matching keep='last'.
+            combined = pd.concat([existing_df, new_data], ignore_index=True)
+            # Dates are compared as int64 nanoseconds, never as formatted strings
+            keys = combined['Date'].values.astype('datetime64[ns]').view('int64')
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            last_of_key = np.append(sorted_keys[1:] != sorted_keys[:-1], True)
+            combined = combined.iloc[order[last_of_key]].reset_index(drop=True)
         print(f"🔍 After concat: total rows={len(combined)}, duplicates removed: {len(existing_df) + len(new_data) - len(combined)}")
         return combined
     except Exception as e:
@@ -156,70 +349,174 @@ def merge_and_deduplicate(existing_df, new_data, interval):
 # ----------------------------------
 def save_and_verify_data(combined, filename, interval):
     try:
-        combined.to_csv(filename, index=False, float_format='%.2f')
-        verify_df = pd.read_csv(filename)
-        expected_columns = ['Date', 'Open', 'High', 'Low', 'Close', 'Volume']
-        if not all(col in verify_df.columns for col in expected_columns):
-            print(f"⚠️ Failed to save {filename} correctly: invalid columns. Expected: {expected_columns}, Found: {verify_df.columns.tolist()}\nFile content preview:\n{verify_df.head()}")
+        write_history(combined, filename, interval)
+    except Exception as e:
+        print(f"⚠️ Failed to save {filename}: {e}")
+        return None
+    return verify_written_data(filename, interval, False, combined['Date'].max(), len(combined))
+
+def append_and_verify_data(new_data, filename, interval):
+    # Writes only the rows past the file's last date, in the file's own column order.
+    try:
+        header = pd.read_csv(filename, nrows=0).columns.tolist()
+        with open(filename, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            missing_newline = f.read(1) != b'\n'
+        if missing_newline:
+            with open(filename, 'a') as f:
+                f.write('\n')
+        write_history(new_data.reindex(columns=header), filename, interval, append=True)
+    except Exception as e:
+        print(f"⚠️ Failed to save {filename}: {e}")
+        return None
+    return verify_written_data(filename, interval, True, new_data['Date'].iloc[-1], len(new_data))
+
+def verify_written_data(filename, interval, append, expected_last_date, row_count):
+    # Trusts the writer and only confirms the last row on disk, instead of re-parsing the file.
+    try:
+        verify_last_date = read_last_date(filename, interval, tail_bytes=512)
+        if verify_last_date.replace(tzinfo=None) != expected_last_date:
+            print(f"⚠️ Failed to save {filename} correctly: last date on disk {verify_last_date}, expected {expected_last_date}")
+            return None
+        if append:
+            print(f"✅ Appended {row_count} new rows to {filename}. Last date: {verify_last_date}")
         else:
-            if interval == "4h":
-                verify_last_date = pd.to_datetime(verify_df['Date'], errors='coerce', format='%Y-%m-%d %H:%M:%S').max()
-            else:
-                verify_last_date = pd.to_datetime(verify_df['Date'], errors='coerce', format='%Y-%m-%d').max()
-            print(f"✅ Saved {len(combined) - (len(verify_df) - len(combined))} new rows to {filename}. Total rows: {len(combined)}, Last date: {verify_last_date}")
+            print(f"✅ Saved {filename}. Total rows: {row_count}, Last date: {verify_last_date}")
+        return verify_last_date
     except Exception as e:
         print(f"⚠️ Failed to verify {filename} after saving: {e}")
+    return None
 
 # ----------------------------------
 # 7. Main Processing Loop
 # ----------------------------------
-print("\n📊 Starting historical data fetch for multiple tickers...\n")
+def write_new_data(ticker, label, filename, last_date, appendable, existing_df, new_data):
+    # Returns the verified last date on disk, or None when nothing was written or the write failed.
+    interval = configs[label]["interval"]
+    if new_data.empty:
+        print(f"⚠️ No new data fetched for {ticker} {label}. Skipping save.\n")
+        return None
+    new_data['Date'] = pd.to_datetime(new_data['Date'], errors='coerce')
+    if last_date is not None and not new_data.empty:
+        cutoff = np.datetime64(last_date.replace(tzinfo=None), 'ns')
+        new_data = new_data.iloc[new_data['Date'].values.astype('datetime64[ns]') > cutoff]
+        if new_data.empty:
+            print(f"⚠️ No new dates beyond {last_date} for {ticker} {label}. Skipping save.\n")
+            return None
+    if os.path.exists(filename):
+        if not os.access(filename, os.W_OK):
+            print(f"⚠️ No write permission for {filename}. Skipping save.")
+            return None
+    if (storage_format == "csv" and appendable and existing_df is None
+            and new_data['Date'].is_monotonic_increasing and new_data['Date'].is_unique):
+        # last_date comes from a verified index entry, so the file is sorted up to it and every
+        # remaining row post-dates it: append instead of rewriting. A date read from the file tail
+        # is not enough, since an out-of-order file's last row need not be its maximum.
+        return append_and_verify_data(new_data, filename, interval)
+    if existing_df is None and os.path.exists(filename):
+        # Read even when last_date is None: rows older than Yahoo's window cannot be re-downloaded
+        try:
+            existing_df = read_history(filename, interval)
+        except Exception as e:
+            print(f"⚠️ Error reading existing {filename}: {e}. File content preview:\nNo data read\nOverwriting with fresh data.")
+    combined = merge_and_deduplicate(existing_df, new_data, interval)
+    return save_and_verify_data(combined, filename, interval)
+
+def process_one(ticker, label, filename, last_date, appendable, existing_df, new_data):
+    # Runs in a worker process; each (ticker, timeframe) owns its file, so the worker writes and
+    # verifies it itself and only the verified last date travels back for the index.
+    # Output is buffered and returned, so the parent prints each file's log in one piece instead
+    # of interleaving lines from several workers.
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        verified_last_date = write_new_data(ticker, label, filename, last_date, appendable, existing_df, new_data)
+    return log.getvalue(), filename, verified_last_date
+
+def save_result(index, ticker, label, result):
+    try:
+        log, filename, verified_last_date = result.get()
+    except Exception as e:
+        print(f"❌ Error processing {ticker} {label}: {e}")
+        return
+    print(log, end='')
+    if verified_last_date is not None:
+        update_index(index, f"{ticker}/{label}", filename, verified_last_date, verified=True)
+
+def update_files(index, plans, end_date):
+    # Submit every (ticker, timeframe) download up front so request latencies overlap;
+    # each result is handed to the process pool for parsing and merging as soon as it arrives.
+    # The pool is created before the executor so workers are forked before any download thread
+    # starts (pyarrow's CSV reader threads from planning may still be alive in the parent).
+    with mp.Pool(min(max_processes, len(plans))) as pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for (ticker, label), (filename, last_date, appendable, start_date, existing_df) in plans.items():
+            interval = configs[label]["interval"]
+            print(f"⏳ Downloading {ticker} {label} ({interval}) from {format_date(start_date, interval)} to {format_date(end_date, interval)}...")
+            futures[(ticker, label)] = executor.submit(fetch_new_data, ticker, start_date, end_date, interval)
+
+        # Each file is written as soon as its worker finishes, so an interrupted run keeps
+        # everything saved up to that point.
+        keys = {future: key for key, future in futures.items()}
+        results = []
+        for future in as_completed(keys):
+            ticker, label = keys[future]
+            filename, last_date, appendable, start_date, existing_df = plans[(ticker, label)]
+            results.append((ticker, label, pool.apply_async(process_one, (ticker, label, filename, last_date, appendable, existing_df, future.result()))))
+            while results and results[0][2].ready():
+                save_result(index, *results.pop(0))
+        for ticker, label, result in results:
+            save_result(index, ticker, label, result)
 
-for ticker in tickers:
-    print(f"\n📈 Processing ticker: {ticker}\n")
+def main():
+    print("\n📊 Starting historical data fetch for multiple tickers...\n")
+
+    # Planning runs in the parent, which also creates every ticker directory before workers start
+    index = load_index()
+    plans = {}
     for label, cfg in configs.items():
-        filename = cfg["filename_template"].format(output_folder=output_folder, ticker=ticker.lower())
         interval = cfg["interval"]
         max_days = cfg["max_days"]
         overlap_days = cfg["overlap_days"]
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        last_date = get_last_date_or_none(filename, interval)
-        if last_date is None and not os.path.exists(filename):
-            start_date = datetime.now(ET) - timedelta(days=max_days)
-            print(f"📁 No existing data for {ticker} {label}. Fetching full {max_days}-day range from {format_date(start_date, interval)}.")
-        elif last_date is None:
-            print(f"📁 Existing file {filename} is corrupt or unreadable. Will re-download.")
-            start_date = datetime.now(ET) - timedelta(days=max_days)
-        else:
-            start_date = last_date - timedelta(days=overlap_days)
-            print(f"🔍 Existing data for {ticker} {label}. Last saved: {last_date}. Refetching from {format_date(start_date, interval)}.")
-        if interval == "4h":
-            max_start = datetime.now(ET) - timedelta(days=729)
-            if start_date < max_start:
-                start_date = max_start
-                print(f"⚠️ Adjusted 4h start date to Yahoo limit: {format_date(start_date, interval)}")
-        end_date = datetime.now(ET) + timedelta(days=1)
-        print(f"⏳ Downloading {ticker} {label} ({interval}) from {format_date(start_date, interval)} to {format_date(end_date, interval)}...")
-        new_data = fetch_new_data(ticker, start_date, end_date, interval)
-        if new_data.empty:
-            print(f"⚠️ No new data fetched for {ticker} {label}. Skipping save.\n")
-            continue
-        new_data['Date'] = pd.to_datetime(new_data['Date'], errors='coerce')
-        if last_date is not None and not new_data.empty:
-            new_data = new_data[new_data['Date'].dt.tz_localize(None) > last_date.replace(tzinfo=None)]
-            if new_data.empty:
-                print(f"⚠️ No new dates beyond {last_date} for {ticker} {label}. Skipping save.\n")
-                continue
-        existing_df = None
-        if os.path.exists(filename):
-            if not os.access(filename, os.W_OK):
-                print(f"⚠️ No write permission for {filename}. Skipping save.")
+        for ticker in tickers:
+            filename = cfg["filename_template"].format(output_folder=output_folder, ticker=ticker.lower(), ext=storage_format)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            migrate_csv_to_parquet(filename, interval)
+            key = f"{ticker}/{label}"
+            (last_date, appendable), existing_df = get_indexed_last_date(index, key, filename), None
+            if last_date is None:
+                last_date, existing_df = get_last_date_or_none(filename, interval)
+                if last_date is not None:
+                    update_index(index, key, filename, last_date)
+            if last_date is not None and is_up_to_date(last_date, interval):
+                print(f"✅ {filename} is up-to-date (last date: {last_date}). Skipping fetch.")
                 continue
-            try:
-                existing_df = pd.read_csv(filename)
-            except Exception as e:
-                print(f"⚠️ Error reading existing {filename}: {e}. File content preview:\n{existing_df.head() if 'existing_df' in locals() else 'No data read'}\nOverwriting with fresh data.")
-        combined = merge_and_deduplicate(existing_df, new_data, interval)
-        save_and_verify_data(combined, filename, interval)
-
-print("🎉 All tickers and timeframes updated successfully!\n")
+            if last_date is None and not os.path.exists(filename):
+                start_date = NOW - timedelta(days=max_days)
+                print(f"📁 No existing data for {ticker} {label}. Fetching full {max_days}-day range from {format_date(start_date, interval)}.")
+            elif last_date is None:
+                print(f"📁 Existing file {filename} is corrupt or unreadable. Will re-download.")
+                start_date = NOW - timedelta(days=max_days)
+            else:
+                start_date = last_date - timedelta(days=overlap_days)
+                print(f"🔍 Existing data for {ticker} {label}. Last saved: {last_date}. Refetching from {format_date(start_date, interval)}.")
+            if interval == "4h":
+                max_start = NOW - timedelta(days=729)
+                if start_date < max_start:
+                    start_date = max_start
+                    print(f"⚠️ Adjusted 4h start date to Yahoo limit: {format_date(start_date, interval)}")
+            plans[(ticker, label)] = (filename, last_date, appendable, start_date, existing_df)
+
+    end_date = NOW + timedelta(days=1)
+    if plans:
+        update_files(index, plans, end_date)
+
+    try:
+        save_index(index)
+    except OSError as e:
+        print(f"⚠️ Failed to save {index_filename}: {e}")
+
+    print("🎉 All tickers and timeframes updated successfully!\n")
+
+if __name__ == "__main__":
+    main()
@@ -7,5 +7,10 @@ close_prices = np.random.random(100)
 # Calculate a simple indicator (SMA)
 sma = talib.SMA(close_prices, timeperiod=10)
 
+# Cross-check against a pure-NumPy SMA: one cumulative sum, NaN-prefixed like TA-Lib's output
+cumsum = np.cumsum(np.insert(close_prices, 0, 0))
+numpy_sma = np.concatenate([np.full(9, np.nan), (cumsum[10:] - cumsum[:-10]) / 10])
+assert np.allclose(sma, numpy_sma, equal_nan=True), "TA-Lib SMA does not match the NumPy reference"
+
 print("TA-Lib installed and working. SMA output:")
 print(sma)